@@ -19,8 +19,8 @@ from selenium.webdriver.support import expected_conditions as EC
 # Imports the expected_conditions module, containing predefined conditions to wait for.
 from selenium.webdriver.common.action_chains import ActionChains
 # Imports the ActionChains class, used for performing complex user interactions like key presses and mouse movements.
-from selenium.common.exceptions import TimeoutException, WebDriverException
-# Imports specific Selenium exceptions for handling timeouts and browser-related errors.
+from selenium.common.exceptions import TimeoutException, WebDriverException, StaleElementReferenceException
+# Imports specific Selenium exceptions for handling timeouts, browser-related errors and elements that were re-rendered.
 import pyperclip
 # Imports the pyperclip library, used for interacting with the system clipboard (copy and paste).
 import json
@@ -33,11 +33,40 @@ import random
 # Imports the random library, used for generating random numbers (not heavily used in this script).
 import string
 # Imports the string library, which provides useful string constants (like lowercase letters).
+import re
+# Imports the re library, used for regular expressions (stripping ANSI escape sequences).
+from itertools import compress, count, islice, repeat
+# Imports iterator helpers, used to find runs of repeated lines without a Python-level loop per line.
+import operator
+# Imports the operator module, used with map() to compare neighbouring lines in C.
+import threading
+# Imports the threading library, used to drive several browsers at once in batch mode.
+import queue
+# Imports the queue library, used to hand prompts to batch worker threads.
+from collections import Counter, deque
+# Imports deque, used for the pending prompt queue and rolling latency windows, and Counter, used to find unique lines when diffing.
+import statistics
+# Imports the statistics library, used to summarize probe latencies.
+import tempfile
+# Imports the tempfile library, used to create a throwaway browser profile for health probes.
+import shutil
+# Imports the shutil library, used to remove the throwaway probe profile afterwards.
+import difflib
+# Imports the difflib library, used to diff re-copied documents in incremental mode.
+import io
+# Imports the io library, used to split text into lines the same way patch does.
+import bisect
+# Imports the bisect library, used to line up unique lines when diffing large documents.
 
 # Configuration file path
 CONFIG_FILE = "ai_sites_config.json"
 # Defines a constant variable for the name of the JSON file that stores AI site configurations.
 
+# ---vvv IMPORTANT: Verify these paths are correct for YOUR system vvv---
+BRAVE_PATH = "/usr/bin/brave-browser"
+CHROMEDRIVER_PATH = "/usr/local/bin/chromedriver"
+# ---^^^ IMPORTANT: Verify these paths are correct for YOUR system ^^^---
+
 # Default configuration
 DEFAULT_CONFIG = {
     "browser_profile": "Default",  # Default Brave profile
@@ -52,9 +81,35 @@ DEFAULT_CONFIG = {
             "initial_xpath": "//*[@id='app']/div/div/div[2]/div/div[2]/div[2]/div[1]/div/div[1]",
             "subsequent_xpath": "/html/body/div[1]/div/div/div[2]/div/div/div[1]/div[3]/div[2]/div[1]/div/div[1]"
         }
+    },
+    "text_preprocessing": {
+        "strip_ansi": True,  # Remove terminal colour/cursor escape codes
+        "collapse_repeated_lines": False,  # Replace runs of identical lines with one line and a count (rewrites code and data)
+        "normalize_whitespace": False,  # Trim trailing whitespace and squeeze blank lines (breaks Markdown line breaks)
+        "chars_per_token": 4.0,  # Rough characters per token, can be overridden per site
+        "token_limit": 100000,  # Can be overridden per site with a "token_limit" key
+        "over_limit_action": "ask",  # "ask", "truncate" or "warn"
+        "preview_chars": 2000  # How much of the clipboard to echo back in the terminal
+    },
+    "batch": {
+        "max_in_flight_per_worker": 1,  # Prompts queued per browser at once
+        "max_consecutive_errors": 2,  # Errors in a row before a browser is taken out of rotation
+        "max_attempts_per_prompt": 3,  # Attempts (across browsers) before a prompt is given up on
+        "reply_timeout": 180,  # Seconds to wait for a reply to finish
+        "latency_window": 5,  # Number of recent replies used for a browser's latency estimate
+        "limit_phrases": ["usage limit", "rate limit", "too many requests", "try again later", "reached your limit"]
+    },
+    "probe": {
+        "interval_seconds": 300,  # Time between background probe rounds
+        "timeout": 30,  # Seconds to wait for a page or input field before a probe counts as failed
+        "history_size": 10,  # Number of recent probes kept per site in the latency table
+        "max_age_seconds": 900,  # Probe results older than this are ignored when picking the fastest site
+        "headless": True,  # Run the probe browser without a window
+        "data_dir_key": "",  # Browser data directory for probes; blank uses a fresh temporary profile
+        "canned_prompt": ""  # If set, also measure reply latency on sites that have a Reply XPath
     }
 }
-# Defines a dictionary containing the default configuration, including browser profile, selected data dir key, data dirs, and AI sites.
+# Defines a dictionary containing the default configuration, including browser profile, selected data dir key, data dirs, AI sites, text preprocessing, batch and probe settings.
 
 def load_config():
     """Load AI site configurations from file or create with defaults if not exists"""
@@ -74,6 +129,15 @@ def load_config():
                     config['browser_data_dirs'] = {"default_apexnelbo": "/home/apexnelbo/.config/BraveSoftware/Brave-Browser"}
                 if 'selected_user_data_dir_key' not in config:
                     config['selected_user_data_dir_key'] = "default_apexnelbo"
+                text_preprocessing = config.setdefault('text_preprocessing', {})
+                for key, value in DEFAULT_CONFIG['text_preprocessing'].items():
+                    text_preprocessing.setdefault(key, value)
+                batch_settings = config.setdefault('batch', {})
+                for key, value in DEFAULT_CONFIG['batch'].items():
+                    batch_settings.setdefault(key, value)
+                probe_settings = config.setdefault('probe', {})
+                for key, value in DEFAULT_CONFIG['probe'].items():
+                    probe_settings.setdefault(key, value)
                 return config
                 # Returns the loaded configuration.
         except json.JSONDecodeError:
@@ -199,6 +263,41 @@ def select_browser_data_dir(config):
         print("Keeping current selection.")
     return config
 
+def configure_text_preprocessing(config):
+    """Configure compaction and token limit settings for outgoing clipboard text"""
+    print("\nConfigure Text Preprocessing:")
+    settings = config.setdefault('text_preprocessing', dict(DEFAULT_CONFIG['text_preprocessing']))
+    print("Press Enter to keep the current value.")
+
+    for key in ['strip_ansi', 'collapse_repeated_lines', 'normalize_whitespace']:
+        value = input(f"{key} (y/n) [{'y' if settings.get(key) else 'n'}]: ").strip().lower()
+        if value in ['y', 'yes']:
+            settings[key] = True
+        elif value in ['n', 'no']:
+            settings[key] = False
+
+    for key, cast in [('chars_per_token', float), ('token_limit', int), ('preview_chars', int)]:
+        value = input(f"{key} [{settings.get(key)}]: ").strip()
+        if value:
+            try:
+                number = cast(value)
+            except ValueError:
+                number = None
+            if is_positive_number(number):
+                settings[key] = number
+            else:
+                print(f"{key} must be a number greater than 0, keeping {settings.get(key)}.")
+
+    action = input(f"over_limit_action (ask/truncate/warn) [{settings.get('over_limit_action')}]: ").strip().lower()
+    if action in ['ask', 'truncate', 'warn']:
+        settings['over_limit_action'] = action
+    elif action:
+        print("Invalid action, keeping current value.")
+
+    save_config(config)
+    print("Text preprocessing settings saved.")
+    return config
+
 
 def select_ai(config):
     """Display and select from available AI sites"""
@@ -206,12 +305,17 @@ def select_ai(config):
     print("\nChoose your AI destination:")
     for key, site in ai_sites.items():
         print(f"{key}: {site['name']} ({site['url']})")
+    print("fastest: Fastest available site (based on probe results)")
+    print_probe_table(config)
     print("\nOptions:")
     print("add: Add a new AI site")
     print("manage: Edit/remove AI sites")
     print("config_profile: Configure Browser Profile")
     print("config_datadir: Configure Browser Data Directories")
     print("select_datadir: Select Browser Data Directory")
+    print("config_text: Configure Text Preprocessing (compaction, token limits)")
+    print("batch: Run a file of prompts across several browser data directories")
+    print(f"probe: {'Stop' if probing_active() else 'Start'} background health probes of all sites")
     print("exit: Close the program")
 
     while True:
@@ -226,6 +330,14 @@ def select_ai(config):
             return 'config_datadir'
         elif choice.lower() == 'select_datadir':
             return 'select_datadir'
+        elif choice.lower() == 'config_text':
+            return 'config_text'
+        elif choice.lower() == 'batch':
+            return 'batch'
+        elif choice.lower() == 'probe':
+            return 'probe'
+        elif choice.lower() == 'fastest':
+            return 'fastest'
         elif choice.lower() == 'exit':
             return 'exit'
         elif choice in ai_sites:
@@ -241,6 +353,7 @@ def add_new_ai(ai_sites):
     url = input("Enter AI URL (include https://): ").strip()
     initial_xpath = input("Enter initial XPath for input field: ").strip()
     subsequent_xpath = input("Enter subsequent XPath for input field: ").strip()
+    reply_xpath = input("Enter XPath matching the AI's reply messages (optional, needed for batch mode): ").strip()
 
     ai_sites[next_id] = {
         "name": name,
@@ -248,6 +361,8 @@ def add_new_ai(ai_sites):
         "initial_xpath": initial_xpath,
         "subsequent_xpath": subsequent_xpath
     }
+    if reply_xpath:
+        ai_sites[next_id]['reply_xpath'] = reply_xpath
 
     return ai_sites
 
@@ -302,6 +417,18 @@ def manage_ai_sites(ai_sites):
                 if subsequent_xpath:
                     ai_sites[choice]['subsequent_xpath'] = subsequent_xpath
 
+                print(f"Current Reply XPath: {ai_sites[choice].get('reply_xpath', '[not set]')}")
+                reply_xpath = input("New Reply XPath (leave blank to keep): ").strip()
+                if reply_xpath:
+                    ai_sites[choice]['reply_xpath'] = reply_xpath
+
+                token_limit = input(f"Token limit [{ai_sites[choice].get('token_limit', 'global default')}]: ").strip()
+                if token_limit:
+                    if token_limit.isdigit() and int(token_limit) > 0:
+                        ai_sites[choice]['token_limit'] = int(token_limit)
+                    else:
+                        print("Token limit must be a whole number greater than 0, keeping current value.")
+
                 print("Note: Browser profile and data directory are configured globally via the main menu options.")
 
             else:
@@ -316,6 +443,366 @@ def generate_random_string(length=8):
     return ''.join(random.choice(letters) for i in range(length))
 
 
+# --- Text preprocessing (compaction and token estimation) ---
+# ANSI_SGR_RE only matches colour/style codes; ANSI_ESCAPE_RE matches CSI sequences (colours, cursor movement),
+# OSC sequences (window titles, hyperlinks) and the remaining two-character escapes.
+ANSI_SGR_RE = re.compile(r'\x1b\[[0-9;]*m')
+ANSI_ESCAPE_RE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])')
+
+def is_positive_number(value):
+    """Check that a setting is a finite number greater than 0 (booleans and strings don't count)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float('inf')
+
+def get_text_settings(config, site):
+    """Merge the global text preprocessing settings with any per-site overrides"""
+    settings = dict(DEFAULT_CONFIG['text_preprocessing'])
+    # The config file can be edited by hand, so numbers are checked here rather than trusted.
+    # A zero chars_per_token would otherwise make every token estimate fail.
+    for key, value in config.get('text_preprocessing', {}).items():
+        if key in ['chars_per_token', 'token_limit', 'preview_chars'] and not is_positive_number(value):
+            print(f"Warning: ignoring invalid {key} {value!r} in the config, using {settings[key]}.")
+        else:
+            settings[key] = value
+    # Sites can carry their own limit and token ratio since context windows differ between AIs
+    for key in ['chars_per_token', 'token_limit']:
+        if key not in site:
+            continue
+        if is_positive_number(site[key]):
+            settings[key] = site[key]
+        else:
+            print(f"Warning: ignoring invalid {key} {site[key]!r} for {site.get('name', 'this site')}, using {settings[key]}.")
+    return settings
+
+def estimate_tokens(text, chars_per_token=4.0):
+    """Cheaply estimate how many tokens a site will count for the given text"""
+    if not text:
+        return 0
+    if text.isascii():
+        return int(len(text) / chars_per_token) + 1
+    # Non-ASCII text (CJK, emoji, ...) tends to cost about one token per character.
+    # Counting UTF-8 bytes is done in C, so this stays fast on very large inputs.
+    extra_bytes = len(text.encode('utf-8')) - len(text)
+    non_ascii_chars = min(len(text), extra_bytes // 2 + 1)
+    return int((len(text) - non_ascii_chars) / chars_per_token) + non_ascii_chars + 1
+
+def compact_lines(text, normalize, collapse):
+    """Trim trailing whitespace, squeeze blank lines and/or collapse runs of identical lines"""
+    # Every per-line step below is a split, map(), compress() or slice, so the work runs in C.
+    # Python only loops once per run of repeated (non-blank) lines.
+    lines = None # Set when normalizing changed the lines, otherwise text is current
+    if normalize:
+        # Cheap substring searches first, so passes with nothing to do are skipped
+        stripped = ' \n' in text or '\t\n' in text or text.endswith((' ', '\t'))
+        if stripped or '\n\n' in text:
+            lines = text.split('\n')
+            if stripped:
+                lines = list(map(str.rstrip, lines))
+            # Drop blank lines that follow another blank line: two lines joined are '' only when both are blank
+            squeezed = [lines[0]]
+            squeezed.extend(compress(islice(lines, 1, None), map(operator.add, islice(lines, 1, None), lines)))
+            # Drop the (now single) blank lines at either end
+            start = 1 if not squeezed[0] else 0
+            end = len(squeezed) - 1 if len(squeezed) > start and not squeezed[-1] else len(squeezed)
+            lines = squeezed[start:end]
+        else:
+            text = text.strip('\n') # No blank runs, at most one blank line at either end
+    if not collapse:
+        return text if lines is None else '\n'.join(lines)
+
+    normalized = lines is not None
+    if lines is None:
+        lines = text.split('\n')
+    # Positions of lines identical to the line before them
+    repeats = list(compress(count(1), map(operator.eq, islice(lines, 1, None), lines)))
+    if repeats and not normalize:
+        # Runs of blank lines are kept as they are (normalizing has already squeezed them)
+        repeats = list(compress(repeats, map(lines.__getitem__, repeats)))
+    if not repeats:
+        return '\n'.join(lines) if normalized else text
+    # Consecutive positions belong to the same run, so a gap larger than 1 starts a new run
+    run_bounds = [0]
+    run_bounds.extend(compress(count(1), map(operator.ne, map(operator.sub, islice(repeats, 1, None), repeats), repeat(1))))
+    run_bounds.append(len(repeats))
+    kept = []
+    position = 0
+    for start, stop in zip(run_bounds, islice(run_bounds, 1, None)):
+        head = repeats[start] - 1
+        kept.extend(lines[position:head])
+        kept.append(f"{lines[head]} [repeated {stop - start + 1} times]")
+        position = repeats[stop - 1] + 1
+    kept.extend(lines[position:])
+    return '\n'.join(kept)
+
+def compact_text(text, settings):
+    """Strip ANSI codes, normalize whitespace and collapse repeated lines according to settings"""
+    if settings.get('strip_ansi') and '\x1b' in text:
+        # Colour codes are by far the most common escapes, and the narrow pattern is cheaper per match.
+        # Joining the pieces from split() is faster than sub() when there are millions of matches.
+        text = ''.join(ANSI_SGR_RE.split(text))
+        if '\x1b' in text:
+            text = ANSI_ESCAPE_RE.sub('', text)
+
+    normalize = settings.get('normalize_whitespace')
+    collapse = settings.get('collapse_repeated_lines')
+    if normalize and '\r' in text:
+        text = text.replace('\r\n', '\n')
+    if normalize or collapse:
+        text = compact_lines(text, normalize, collapse)
+    return text
+
+def truncate_to_tokens(text, max_tokens, chars_per_token=4.0):
+    """Keep the start and the end of the text so it fits in roughly max_tokens tokens"""
+    estimate = estimate_tokens(text, chars_per_token)
+    if estimate <= max_tokens:
+        return text
+    budget = int(len(text) * max_tokens / estimate)
+    # Leave room for the marker line, but at most half the budget, so small limits still keep some of the text
+    budget -= min(64, budget // 2)
+    # Logs usually matter most at the end, so give the tail the bigger share
+    head_end = text.rfind('\n', 0, budget // 4)
+    head_end = head_end if head_end > 0 else budget // 4
+    tail_cut = max(head_end, len(text) - (budget - head_end))
+    tail_start = text.find('\n', tail_cut)
+    tail_start = tail_start + 1 if tail_start != -1 else tail_cut
+    removed_lines = text.count('\n', head_end, tail_start)
+    if removed_lines:
+        marker = f"{removed_lines:,} lines"
+    else:
+        marker = f"{tail_start - head_end:,} characters"
+    return f"{text[:head_end]}\n[... {marker} truncated to fit the token limit ...]\n{text[tail_start:]}"
+
+def preprocess_clipboard_text(text, settings):
+    """Compact clipboard text and report the size change and token estimate"""
+    start_time = time.perf_counter()
+    compacted = compact_text(text, settings)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    if compacted != text:
+        print(f"Compacted clipboard text: {len(text):,} -> {len(compacted):,} characters ({elapsed_ms:.0f} ms).")
+    return compacted
+
+def apply_token_limit(text, prompt_text, settings):
+    """Show the token estimate and warn, truncate or cancel when it exceeds the configured limit.
+       Returns the (possibly truncated) text, or None if the user cancelled."""
+    chars_per_token = settings.get('chars_per_token', 4.0)
+    token_limit = settings.get('token_limit')
+    prompt_tokens = estimate_tokens(prompt_text, chars_per_token)
+    estimate = estimate_tokens(text, chars_per_token) + prompt_tokens
+    print(f"Estimated tokens: ~{estimate:,}" + (f" (limit {token_limit:,})" if token_limit else ""))
+
+    if not token_limit or estimate <= token_limit:
+        return text
+
+    print(f"Warning: the estimated size exceeds this site's limit of {token_limit:,} tokens.")
+    action = settings.get('over_limit_action', 'ask')
+    if action == 'ask':
+        while True:
+            answer = input("Truncate (t), send anyway (s) or cancel (c)? ").strip().lower()
+            if answer in ['t', 's', 'c']:
+                break
+            print("Invalid input. Please enter 't', 's' or 'c'.")
+        if answer == 'c':
+            return None
+        action = 'truncate' if answer == 't' else 'warn'
+
+    if action == 'truncate':
+        text = truncate_to_tokens(text, max(0, token_limit - prompt_tokens), chars_per_token)
+        print(f"Truncated to ~{estimate_tokens(text, chars_per_token) + prompt_tokens:,} tokens.")
+    return text
+# --- End text preprocessing ---
+
+# --- Incremental context (send only what changed since the last text sent) ---
+INCREMENTAL_NOTE = ("The document below is a unified diff against the version I sent earlier in this conversation. "
+                    "Apply it to that version and treat the result as the current document.")
+UNCHANGED_NOTE = "[The document is unchanged since the version I sent earlier in this conversation.]"
+
+def format_unified_range(start, length):
+    """Format a hunk range the way unified diffs do (1-based start, omitted length when it is 1)"""
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+def common_line_count(old_lines, new_lines, limit, from_end=False, block_size=1024):
+    """Count identical lines at the start (or end) of two line lists, looking at no more than limit lines"""
+    def block(lines, start, stop):
+        return lines[start:stop] if not from_end else lines[len(lines) - stop:len(lines) - start]
+
+    count = 0
+    # Compare whole blocks first (list comparison runs in C), then find the exact line in the first differing block
+    while count + block_size <= limit and block(old_lines, count, count + block_size) == block(new_lines, count, count + block_size):
+        count += block_size
+    while count < limit and block(old_lines, count, count + 1) == block(new_lines, count, count + 1):
+        count += 1
+    return count
+
+def split_lines(text):
+    """Split text into lines that keep their newline, breaking only where patch does (str.splitlines also breaks at \\r)"""
+    return io.StringIO(text, newline='\n').readlines()
+
+def diff_line(marker, line):
+    """Format one diff line, flagging a last line without a newline the way diff and patch expect"""
+    if line.endswith('\n'):
+        return marker + line
+    return f"{marker}{line}\n\\ No newline at end of file\n"
+
+def anchor_lines(old_lines, new_lines):
+    """Pair up lines that occur exactly once in both lists, keeping the longest set of pairs that is in order in both"""
+    old_counts = Counter(old_lines)
+    new_counts = Counter(new_lines)
+    new_positions = {line: j for j, line in enumerate(new_lines) if new_counts[line] == 1}
+    pairs = [(i, new_positions[line]) for i, line in enumerate(old_lines)
+             if old_counts[line] == 1 and line in new_positions]
+    positions = [j for _, j in pairs]
+    if all(map(operator.lt, positions, islice(positions, 1, None))):
+        return pairs # Nothing was moved, which is the usual case
+
+    # Longest increasing run of new positions (patience sorting), so no two anchors cross
+    tails = [] # tails[k]: index in pairs of the smallest last position of an increasing run of length k + 1
+    tail_positions = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tail_positions, j)
+        if k:
+            previous[index] = tails[k - 1]
+        if k == len(tails):
+            tails.append(index)
+            tail_positions.append(j)
+        else:
+            tails[k] = index
+            tail_positions[k] = j
+    anchors = []
+    index = tails[-1] if tails else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]
+
+def diff_opcodes(old_lines, new_lines, max_difflib_lines=2000):
+    """Opcodes like SequenceMatcher.get_opcodes, anchoring on unique lines first where a span is too long for difflib.
+       difflib slows down sharply when many scattered edits fall in one long span, so it only sees the gaps between anchors."""
+    opcodes = []
+    # Work items are ('op', opcode) or ('span', old_start, old_stop, new_start, new_stop), popped in document order
+    stack = [('span', 0, len(old_lines), 0, len(new_lines))]
+    while stack:
+        item = stack.pop()
+        if item[0] == 'op':
+            tag, i1, i2, j1, j2 = item[1]
+            if i1 == i2 and j1 == j2:
+                continue
+            if tag == 'equal' and opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], i2, opcodes[-1][3], j2)
+            else:
+                opcodes.append(item[1])
+            continue
+
+        _, alo, ahi, blo, bhi = item
+        old_span = old_lines[alo:ahi]
+        new_span = new_lines[blo:bhi]
+        head = common_line_count(old_span, new_span, min(len(old_span), len(new_span)))
+        tail = common_line_count(old_span, new_span, min(len(old_span), len(new_span)) - head, from_end=True)
+        items = [('op', ('equal', alo, alo + head, blo, blo + head))]
+        alo, ahi, blo, bhi = alo + head, ahi - tail, blo + head, bhi - tail
+        if alo == ahi or blo == bhi:
+            items.append(('op', ('delete' if alo < ahi else 'insert', alo, ahi, blo, bhi)))
+        elif (ahi - alo) + (bhi - blo) <= max_difflib_lines:
+            matcher = difflib.SequenceMatcher(None, old_lines[alo:ahi], new_lines[blo:bhi])
+            items.extend(('op', (tag, alo + i1, alo + i2, blo + j1, blo + j2)) for tag, i1, i2, j1, j2 in matcher.get_opcodes())
+        else:
+            anchors = anchor_lines(old_lines[alo:ahi], new_lines[blo:bhi])
+            if not anchors:
+                # Nothing to line the spans up on (e.g. only repeated lines), so diff them in matching slices
+                chunks = -(-max(ahi - alo, bhi - blo) // max(1, max_difflib_lines // 2))
+                old_bounds = [alo + (ahi - alo) * k // chunks for k in range(chunks + 1)]
+                new_bounds = [blo + (bhi - blo) * k // chunks for k in range(chunks + 1)]
+                items.extend(('span', old_bounds[k], old_bounds[k + 1], new_bounds[k], new_bounds[k + 1]) for k in range(chunks))
+            # Anchors with identical gaps before them extend one equal opcode, and only the gaps that differ are diffed further
+            i, j = run_i, run_j = alo, blo
+            for anchor_i, anchor_j in anchors:
+                anchor_i += alo
+                anchor_j += blo
+                if anchor_i - i == anchor_j - j and (anchor_i == i or old_lines[i:anchor_i] == new_lines[j:anchor_j]):
+                    i, j = anchor_i + 1, anchor_j + 1
+                    continue
+                items.append(('op', ('equal', run_i, i, run_j, j)))
+                items.append(('span', i, anchor_i, j, anchor_j))
+                run_i, run_j = anchor_i, anchor_j
+                i, j = anchor_i + 1, anchor_j + 1
+            if anchors:
+                items.append(('op', ('equal', run_i, i, run_j, j)))
+                items.append(('span', i, ahi, j, bhi))
+        items.append(('op', ('equal', ahi, ahi + tail, bhi, bhi + tail)))
+        stack.extend(reversed(items))
+    return opcodes
+
+def group_opcodes(opcodes, context=3):
+    """Split opcodes into hunks with context lines, like SequenceMatcher.get_grouped_opcodes"""
+    codes = list(opcodes) or [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # Split at long unchanged stretches, keeping context lines on both sides
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def line_diff(old_text, new_text, context=3, max_difflib_lines=2000):
+    """Unified line diff of two texts, or "" if they are the same.
+       Identical leading and trailing lines are skipped before diffing, so small edits
+       to very large documents only pay for the lines around the edit."""
+    old_lines = split_lines(old_text)
+    new_lines = split_lines(new_text)
+    if old_lines == new_lines:
+        return ""
+
+    output = ["--- previous\n", "+++ current\n"]
+    for group in group_opcodes(diff_opcodes(old_lines, new_lines, max_difflib_lines), context):
+        old_start, old_stop = group[0][1], group[-1][2]
+        new_start, new_stop = group[0][3], group[-1][4]
+        output.append(f"@@ -{format_unified_range(old_start, old_stop - old_start)} "
+                      f"+{format_unified_range(new_start, new_stop - new_start)} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                output.extend(diff_line(' ', line) for line in old_lines[i1:i2])
+                continue
+            if tag in ['replace', 'delete']:
+                output.extend(diff_line('-', line) for line in old_lines[i1:i2])
+            if tag in ['replace', 'insert']:
+                output.extend(diff_line('+', line) for line in new_lines[j1:j2])
+    return ''.join(output)
+
+def build_incremental_text(previous_text, current_text):
+    """Return a framed diff of current_text against previous_text, or current_text when a diff would not be smaller"""
+    if not previous_text:
+        print("No earlier text in this conversation to diff against. Sending the full text.")
+        return current_text
+
+    start_time = time.perf_counter()
+    diff = line_diff(previous_text, current_text)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    # The fence must be longer than any run of backticks in the diff, or a Markdown code block in it would end the fence early
+    fence = '`' * max(3, max(map(len, re.findall(r'`+', diff)), default=0) + 1)
+    incremental_text = f"{INCREMENTAL_NOTE}\n\n{fence}diff\n{diff}{fence}" if diff else UNCHANGED_NOTE
+    if len(incremental_text) >= len(current_text):
+        print("The diff is not smaller than the document. Sending the full text.")
+        return current_text
+    print(f"Sending a diff: {len(incremental_text):,} characters instead of {len(current_text):,} "
+          f"({len(incremental_text) / len(current_text):.1%}, computed in {elapsed_ms:.0f} ms).")
+    return incremental_text
+# --- End incremental context ---
+
+
 # --- MODIFIED open_in_browser ---
 def open_in_browser(url, browser_profile="Default", user_data_dir=None):
     """Open the selected AI site in Brave browser using the specified profile
@@ -324,8 +811,8 @@ def open_in_browser(url, browser_profile="Default", user_data_dir=None):
     default_user_data_dir = "/home/apexnelbo/.config/BraveSoftware/Brave-Browser"
     user_data_dir_to_use = user_data_dir if user_data_dir else default_user_data_dir
     profile_dir = browser_profile # Use the provided browser profile
-    brave_path = "/usr/bin/brave-browser"
-    chromedriver_path = "/usr/local/bin/chromedriver"
+    brave_path = BRAVE_PATH
+    chromedriver_path = CHROMEDRIVER_PATH
     # ---^^^ IMPORTANT: Verify these paths are correct for YOUR system ^^^---
 
     options = Options()
@@ -413,7 +900,7 @@ def open_in_browser(url, browser_profile="Default", user_data_dir=None):
 # --- END MODIFIED open_in_browser ---
 
 # Added 'wait' as a parameter
-def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait):
+def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait, text_settings=None, conversation=None):
     """Send clipboard content with additional user input to AI chat interface"""
     # Removed wait initialization from here
     # wait = WebDriverWait(driver, 30) # 30 second wait time
@@ -421,7 +908,7 @@ def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait):
         xpath_to_use = initial_xpath if is_initial else subsequent_xpath
         print(f"Attempting to find input element using XPath: {xpath_to_use}")
 
-        if mode == "1":  # Text mode
+        if mode in ["1", "5"]:  # Text mode (5 sends only what changed since the last text sent)
             print("\nPlease copy the text you want to send to the clipboard.")
             input("Press Enter after copying the text...")
             clipboard_text = pyperclip.paste()
@@ -433,24 +920,53 @@ def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait):
             # Store the original clipboard content
             original_clipboard_text = clipboard_text
 
+            # Compact the text (ANSI codes, repeated lines, whitespace) before showing and sending it
+            if text_settings and clipboard_text:
+                clipboard_text = preprocess_clipboard_text(clipboard_text, text_settings)
+
+            # The document the AI will have once this is sent, kept so the next incremental send can diff against it
+            document = clipboard_text
+            if mode == "5" and clipboard_text:
+                previous_document = conversation.get('last_document') if conversation is not None else None
+                clipboard_text = build_incremental_text(previous_document, clipboard_text)
+
+            preview_chars = text_settings.get('preview_chars') if text_settings else None
             print("\nClipboard content detected:")
             print("------------------------")
-            print(clipboard_text if clipboard_text else "[Clipboard was empty]")
+            if not clipboard_text:
+                print("[Clipboard was empty]")
+            elif preview_chars and len(clipboard_text) > preview_chars:
+                # Echoing megabytes into the terminal is slower than the send itself
+                print(clipboard_text[:preview_chars])
+                print(f"[... {len(clipboard_text) - preview_chars:,} more characters not shown ...]")
+            else:
+                print(clipboard_text)
             print("------------------------")
 
             additional_text = input("\nType your question or additional context (press Enter when done, leave blank if none):\n").strip()
 
-            final_text = original_clipboard_text  # Use the original content here
+            if text_settings and clipboard_text:
+                limited_text = apply_token_limit(clipboard_text, additional_text, text_settings)
+                if limited_text is None:
+                    print("\nSend cancelled.")
+                    return False
+                if limited_text != clipboard_text:
+                    # The AI only sees what survives truncation, and a truncated diff is no base for the next one
+                    document = limited_text if clipboard_text == document else None
+                clipboard_text = limited_text
+
+            final_text = clipboard_text  # Use the (possibly compacted) clipboard content here
             if additional_text:
                 # Add separators for clarity when combining
-                final_text = f"{original_clipboard_text}\n\n---\n\n{additional_text}"
+                final_text = f"{clipboard_text}\n\n---\n\n{additional_text}"
 
-            # Update clipboard ONLY if additional text was added, to avoid pasting just the prompt
-            if additional_text:
+            # Update clipboard ONLY if the text changed, to avoid pasting just the prompt
+            if final_text != original_clipboard_text:
                 pyperclip.copy(final_text)
-                print("\nSending combined text (original clipboard + your input) to AI...")
-            elif original_clipboard_text: # Use the original here as well
-                print("\nSending original clipboard text to AI...")
+            if additional_text:
+                print("\nSending combined text (clipboard + your input) to AI...")
+            elif clipboard_text:
+                print("\nSending clipboard text to AI...")
             else:
                 print("\nNothing to send (Clipboard was empty and no additional text provided).")
                 return False # Nothing to send, return False for continue
@@ -472,6 +988,9 @@ def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait):
             print("Content sent.")
             # --- End Common Paste Logic ---
 
+            if conversation is not None and original_clipboard_text:
+                conversation['last_document'] = document
+
             # Ask if the user wants to continue the conversation
             while True:
                 continue_choice = input("Continue conversation? (y/n): ").strip().lower()
@@ -536,6 +1055,547 @@ def send_to_ai(driver, mode, initial_xpath, subsequent_xpath, is_initial, wait):
         print(f"An unexpected error occurred in send_to_ai: {e}")
         return False # Indicate no continuation on error
 
+# --- Batch mode (one browser per data directory) ---
+# Copying to the system clipboard and pasting it must not interleave between worker threads
+CLIPBOARD_LOCK = threading.Lock()
+
+def load_prompts(path):
+    """Read prompts from a file: a JSON list, blocks separated by '---' lines, or one prompt per line"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if path.endswith('.json'):
+        prompts = json.loads(content)
+        # A string or object would otherwise be split into one prompt per character or key
+        if not isinstance(prompts, list):
+            raise ValueError("the file must contain a JSON list of prompts")
+        blocks = [str(prompt) for prompt in prompts]
+    elif re.search(r'^---\s*$', content, re.M):
+        blocks = re.split(r'^---\s*$', content, flags=re.M)
+    else:
+        blocks = content.splitlines()
+    return [block.strip() for block in blocks if block.strip()]
+
+# Banners, toasts and error notices that sites use to announce limits
+LIMIT_NOTICE_XPATH = "//*[@role='alert' or @role='status' or @aria-live='assertive' or @aria-live='polite']"
+
+# Limit notices are a sentence or two; a longer reply that mentions a rate limit is a real answer
+LIMIT_NOTICE_MAX_CHARS = 1000
+
+def page_shows_limit(driver, reply_xpath, limit_phrases, reply=None):
+    """Check whether the newest reply (or the given reply text) or an alert on the page mentions a usage or rate limit"""
+    # The whole page also holds the prompt, which may well mention limits itself, so only look where sites report them
+    texts = []
+    try:
+        if reply is None:
+            replies = driver.find_elements(By.XPATH, reply_xpath)
+            reply = replies[-1].text if replies else ""
+        if len(reply) <= LIMIT_NOTICE_MAX_CHARS:
+            texts.append(reply)
+        texts.extend(element.text for element in driver.find_elements(By.XPATH, LIMIT_NOTICE_XPATH))
+    except WebDriverException:
+        pass # Keep whatever was read before the page changed underneath us
+    notice_text = '\n'.join(texts).lower()
+    return any(phrase.lower() in notice_text for phrase in limit_phrases)
+
+def wait_for_reply(driver, reply_xpath, previous_count, timeout, settle_time=2.0):
+    """Wait for a new reply element to appear and its text to stop changing, then return the text"""
+    deadline = time.monotonic() + timeout
+    WebDriverWait(driver, timeout).until(lambda d: len(d.find_elements(By.XPATH, reply_xpath)) > previous_count)
+
+    # Replies are streamed in, so only treat the reply as finished once it has stopped growing
+    last_text = None
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            text = driver.find_elements(By.XPATH, reply_xpath)[-1].text
+        except (StaleElementReferenceException, IndexError):
+            time.sleep(0.5) # The reply was re-rendered, look it up again
+            continue
+        now = time.monotonic()
+        if text != last_text:
+            last_text = text
+            stable_since = now
+        elif text and now - stable_since >= settle_time:
+            return text
+        time.sleep(0.5)
+    raise TimeoutException(f"Reply did not finish within {timeout} seconds")
+
+def submit_prompt(driver, site, prompt, timeout):
+    """Open a fresh chat on the site, paste and send the prompt and return the reply text"""
+    wait = WebDriverWait(driver, 30)
+    driver.get(site['url'])
+    search_bar = wait.until(EC.visibility_of_element_located((By.XPATH, site['initial_xpath'])))
+    previous_count = len(driver.find_elements(By.XPATH, site['reply_xpath']))
+    search_bar.click() # Ensure focus
+    time.sleep(0.2)
+
+    with CLIPBOARD_LOCK:
+        pyperclip.copy(prompt)
+        ActionChains(driver).key_down(Keys.CONTROL).send_keys('v').key_up(Keys.CONTROL).perform()
+        time.sleep(0.3) # Give paste time to register before another worker reuses the clipboard
+    ActionChains(driver).send_keys(Keys.RETURN).perform()
+    return wait_for_reply(driver, site['reply_xpath'], previous_count, timeout)
+
+def worker_latency(worker, default_latency):
+    """Average of the worker's recent reply latencies, or default_latency if it has none yet"""
+    if worker['latencies']:
+        return sum(worker['latencies']) / len(worker['latencies'])
+    return default_latency
+
+def pick_worker(workers, max_in_flight, exclude=None):
+    """Pick the ready worker expected to finish a new prompt soonest, or None if all are busy (exclude is a last resort)"""
+    candidates = [w for w in workers if w['status'] == 'ready' and w['in_flight'] < max_in_flight]
+    if exclude is not None and any(w['key'] != exclude and w['status'] in ['starting', 'ready'] for w in workers):
+        candidates = [w for w in candidates if w['key'] != exclude]
+    if not candidates:
+        return None
+    # Workers without any replies yet are assumed to be as fast as the pool average, so they get tried
+    known = [latency for w in workers for latency in w['latencies']]
+    default_latency = sum(known) / len(known) if known else 1.0
+    # A new prompt has to wait for everything already queued on that worker
+    return min(candidates, key=lambda w: ((w['in_flight'] + 1) * worker_latency(w, default_latency), w['in_flight']))
+
+def take_next_prompt(state, workers, max_in_flight):
+    """Pop the next pending prompt together with the worker to run it, or None if nothing can be sent yet"""
+    for position, item in enumerate(state['pending']):
+        # Don't hand a failed prompt straight back to the worker that just failed it
+        worker = pick_worker(workers, max_in_flight, exclude=item[3])
+        if worker:
+            del state['pending'][position]
+            return worker, item
+        if item[3] is None:
+            return None # No worker is free at all
+    return None
+
+def requeue_prompt(state, item, settings, error, worker_key):
+    """Put a failed prompt back on the pending queue, or record it as failed after too many attempts"""
+    index, prompt, attempts, _ = item
+    attempts += 1
+    if attempts >= settings['max_attempts_per_prompt']:
+        state['results'][index] = {"prompt": prompt, "status": "failed", "error": error, "attempts": attempts}
+    else:
+        state['pending'].appendleft((index, prompt, attempts, worker_key))
+
+def retire_worker(worker, state, reason):
+    """Take a worker out of rotation and hand its queued prompts back to the pool (call with the lock held)"""
+    worker['status'] = 'retired'
+    worker['retired_reason'] = reason
+    print(f"[{worker['key']}] Taken out of rotation: {reason}")
+    while True:
+        try:
+            item = worker['inbox'].get_nowait()
+        except queue.Empty:
+            break
+        if item is not None:
+            worker['in_flight'] -= 1
+            state['pending'].appendleft(item)
+
+def batch_worker(worker, site, browser_profile, settings, state):
+    """Launch a browser for one data directory and run the prompts handed to it until told to stop"""
+    condition = state['condition']
+    driver = open_in_browser(site['url'], browser_profile, worker['user_data_dir'])
+    with condition:
+        worker['status'] = 'ready' if driver else 'failed'
+        condition.notify_all()
+    if driver is None:
+        return
+
+    try:
+        while True:
+            item = worker['inbox'].get()
+            if item is None:
+                with condition:
+                    worker['status'] = 'finished'
+                break
+            start_time = time.monotonic()
+            reply = None
+            error = None
+            try:
+                reply = submit_prompt(driver, site, item[1], settings['reply_timeout'])
+            except TimeoutException as e:
+                error = f"Timed out: {e.msg or e}"
+            except WebDriverException as e:
+                error = f"WebDriver error: {e.msg or e}"
+            except Exception as e:
+                error = f"Unexpected error: {e}"
+            latency = time.monotonic() - start_time
+            # Some sites answer with their limit notice instead of failing, so successful replies are checked too
+            limited = page_shows_limit(driver, site['reply_xpath'], settings['limit_phrases'], reply)
+            if limited and error is None:
+                error = "Usage limit notice instead of a reply"
+
+            with condition:
+                worker['in_flight'] -= 1
+                if error is None:
+                    worker['latencies'].append(latency)
+                    worker['consecutive_errors'] = 0
+                    worker['completed'] += 1
+                    state['results'][item[0]] = {"prompt": item[1], "status": "ok", "response": reply,
+                                                 "worker": worker['key'], "latency": round(latency, 2)}
+                    print(f"[{worker['key']}] Prompt {item[0] + 1} answered in {latency:.1f}s")
+                else:
+                    worker['consecutive_errors'] += 1
+                    print(f"[{worker['key']}] Prompt {item[0] + 1} failed: {error}")
+                    requeue_prompt(state, item, settings, error, worker['key'])
+                    if limited:
+                        retire_worker(worker, state, "usage limit reached")
+                    elif worker['consecutive_errors'] >= settings['max_consecutive_errors']:
+                        retire_worker(worker, state, f"{worker['consecutive_errors']} errors in a row")
+                condition.notify_all()
+            if worker['status'] == 'retired':
+                break
+    finally:
+        try:
+            driver.quit()
+        except Exception:
+            pass # Ignore errors during cleanup quit
+
+def save_batch_results(results, prompts_path):
+    """Save batch results next to the prompts file, falling back to the working and temp directories"""
+    file_name = f"{os.path.splitext(os.path.basename(prompts_path))[0]}_results.json"
+    # The batch may have taken hours, so an unwritable directory must not lose the replies
+    for directory in [os.path.dirname(prompts_path), os.getcwd(), tempfile.gettempdir()]:
+        results_path = os.path.join(directory, file_name)
+        try:
+            with open(results_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=4, ensure_ascii=False)
+        except OSError as e:
+            print(f"Could not save results to '{results_path}': {e}")
+            continue
+        print(f"Results saved to '{results_path}'.")
+        return results_path
+    return None
+
+def run_batch(config):
+    """Spread a file of prompts for one site across browsers for several data directories"""
+    print("\nRun Batch:")
+    ai_sites = config.get('ai_sites', {})
+    if not ai_sites:
+        print("No sites configured yet.")
+        return
+    for key, site in ai_sites.items():
+        print(f"{key}: {site['name']} ({site['url']})")
+    site_key = input("Select AI by number: ").strip()
+    if site_key not in ai_sites:
+        print("Invalid site number.")
+        return
+    site = ai_sites[site_key]
+
+    if not site.get('reply_xpath'):
+        # Batch mode has to know when a reply is finished before sending the next prompt
+        reply_xpath = input("This site has no Reply XPath yet. Enter XPath matching the AI's reply messages: ").strip()
+        if not reply_xpath:
+            print("A Reply XPath is required for batch mode.")
+            return
+        site['reply_xpath'] = reply_xpath
+        save_config(config)
+
+    prompts_path = input("Enter the path to the prompts file (one prompt per line, '---' between multi-line prompts, or a JSON list): ").strip()
+    try:
+        prompts = load_prompts(prompts_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not read prompts from '{prompts_path}': {e}")
+        return
+    if not prompts:
+        print("No prompts found in the file.")
+        return
+
+    browser_data_dirs = config.get('browser_data_dirs', {})
+    print("\nAvailable Browser Data Directories:")
+    for key, path in browser_data_dirs.items():
+        print(f"{key}: {path}")
+    selection = input("Enter the data directories to use, separated by commas (leave blank to use all): ").strip()
+    keys = [key.strip() for key in selection.split(',') if key.strip()] if selection else list(browser_data_dirs)
+    unknown = [key for key in keys if key not in browser_data_dirs]
+    if unknown:
+        print(f"Unknown data directories: {', '.join(unknown)}")
+        return
+    # A data directory can only be opened by one browser at a time
+    unique_keys = []
+    for key in keys:
+        if browser_data_dirs[key] in [browser_data_dirs[k] for k in unique_keys]:
+            print(f"Skipping '{key}': its path is already used by another selected entry.")
+        else:
+            unique_keys.append(key)
+    keys = unique_keys
+
+    settings = dict(DEFAULT_CONFIG['batch'])
+    settings.update(config.get('batch', {}))
+    max_in_flight = max(1, int(settings['max_in_flight_per_worker']))
+    browser_profile = config.get('browser_profile', 'Default')
+
+    state = {
+        "condition": threading.Condition(),
+        # Each pending item is (index, prompt, attempts, key of the worker that last failed it)
+        "pending": deque((index, prompt, 0, None) for index, prompt in enumerate(prompts)),
+        "results": {}
+    }
+    workers = []
+    for key in keys:
+        workers.append({
+            "key": key,
+            "user_data_dir": browser_data_dirs[key],
+            "status": "starting",
+            "inbox": queue.Queue(),
+            "in_flight": 0,
+            "latencies": deque(maxlen=max(1, int(settings['latency_window']))),
+            "consecutive_errors": 0,
+            "completed": 0,
+            "retired_reason": None
+        })
+
+    print(f"\nRunning {len(prompts)} prompts on {site['name']} across {len(workers)} browser(s)...")
+    start_time = time.monotonic()
+    threads = []
+    for worker in workers:
+        thread = threading.Thread(target=batch_worker, args=(worker, site, browser_profile, settings, state), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    condition = state['condition']
+    try:
+        with condition:
+            while True:
+                busy = any(w['in_flight'] for w in workers)
+                if not state['pending'] and not busy:
+                    break
+                if not any(w['status'] in ['starting', 'ready'] for w in workers):
+                    print("No browsers left in rotation.")
+                    break
+                assignment = take_next_prompt(state, workers, max_in_flight)
+                if assignment:
+                    worker, item = assignment
+                    worker['in_flight'] += 1
+                    worker['inbox'].put(item)
+                else:
+                    condition.wait(timeout=1.0)
+    except KeyboardInterrupt:
+        print("\nBatch interrupted. Waiting for browsers to close...")
+
+    for worker in workers:
+        worker['inbox'].put(None)
+    for thread in threads:
+        thread.join(timeout=settings['reply_timeout'])
+    elapsed = time.monotonic() - start_time
+
+    results = []
+    for index, prompt in enumerate(prompts):
+        results.append(state['results'].get(index, {"prompt": prompt, "status": "not sent"}))
+    completed = sum(1 for result in results if result['status'] == 'ok')
+    print(f"\nBatch finished: {completed}/{len(prompts)} prompts answered in {elapsed:.1f}s "
+          f"({completed / elapsed * 60 if elapsed else 0:.1f} prompts/minute).")
+    for worker in workers:
+        average = f"{worker_latency(worker, 0):.1f}s avg" if worker['latencies'] else "no replies"
+        status = worker['status'] + (f" ({worker['retired_reason']})" if worker['retired_reason'] else "")
+        print(f"  {worker['key']}: {worker['completed']} answered, {average}, {status}")
+
+    save_batch_results(results, prompts_path)
+    input("Press Enter to return to AI selection...")
+# --- End batch mode ---
+
+# --- Health probes and latency-based routing ---
+PROBE_STATS = {} # Site key -> deque of recent probe samples (the rolling latency table)
+PROBE_LOCK = threading.Lock()
+PROBE_STATE = {"thread": None, "stop_event": None}
+
+def get_probe_settings(config):
+    """Return the probe settings with defaults filled in"""
+    settings = dict(DEFAULT_CONFIG['probe'])
+    settings.update(config.get('probe', {}))
+    return settings
+
+def launch_probe_browser(config, settings):
+    """Launch a separate browser for probing, returning (driver, temporary profile dir or None)"""
+    options = Options()
+    options.binary_location = BRAVE_PATH
+    temp_dir = None
+    data_dir = config.get('browser_data_dirs', {}).get(settings.get('data_dir_key') or '')
+    if data_dir:
+        options.add_argument(f"--user-data-dir={data_dir}")
+        options.add_argument(f"--profile-directory={config.get('browser_profile', 'Default')}")
+    else:
+        # A fresh profile avoids locking the profile the user is chatting in
+        temp_dir = tempfile.mkdtemp(prefix="invoke-probe-")
+        options.add_argument(f"--user-data-dir={temp_dir}")
+    if settings.get('headless'):
+        options.add_argument("--headless=new")
+    else:
+        options.add_argument("--window-position=2000,2000") # Keep the probe window out of the way
+    options.add_argument("--no-first-run")
+    options.add_argument("--no-default-browser-check")
+
+    try:
+        driver = webdriver.Chrome(service=Service(executable_path=CHROMEDRIVER_PATH), options=options)
+    except Exception:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    driver.set_page_load_timeout(settings['timeout'])
+    return driver, temp_dir
+
+def probe_site(driver, site, settings):
+    """Load a site once and measure time-to-interactive, input lookup time and optionally reply latency"""
+    sample = {"time": time.time(), "url": site['url'], "ok": False,
+              "interactive": None, "locate": None, "reply": None, "error": None}
+    try:
+        start_time = time.monotonic()
+        driver.get(site['url'])
+        load_time = time.monotonic() - start_time
+        # Prefer the browser's own navigation timing; fall back to how long the page load took
+        dom_interactive = driver.execute_script(
+            "var n = performance.getEntriesByType('navigation')[0]; return n ? n.domInteractive : null;")
+        sample['interactive'] = round(dom_interactive / 1000, 3) if dom_interactive else round(load_time, 3)
+
+        locate_start = time.monotonic()
+        search_bar = WebDriverWait(driver, settings['timeout']).until(
+            EC.visibility_of_element_located((By.XPATH, site['initial_xpath'])))
+        sample['locate'] = round(time.monotonic() - locate_start, 3)
+
+        if settings.get('canned_prompt') and site.get('reply_xpath'):
+            previous_count = len(driver.find_elements(By.XPATH, site['reply_xpath']))
+            reply_start = time.monotonic()
+            # Typed rather than pasted so probes never touch the user's clipboard
+            search_bar.click()
+            search_bar.send_keys(settings['canned_prompt'])
+            search_bar.send_keys(Keys.RETURN)
+            wait_for_reply(driver, site['reply_xpath'], previous_count, settings['timeout'])
+            sample['reply'] = round(time.monotonic() - reply_start, 3)
+        sample['ok'] = True
+    except TimeoutException:
+        sample['error'] = "timed out"
+    except WebDriverException as e:
+        sample['error'] = (e.msg or str(e)).strip().splitlines()[0]
+    except Exception as e:
+        sample['error'] = str(e)
+    return sample
+
+def record_probe_sample(site_key, sample, history_size):
+    """Add a probe sample to the rolling latency table"""
+    with PROBE_LOCK:
+        samples = PROBE_STATS.get(site_key)
+        if samples is None or samples.maxlen != history_size:
+            samples = deque(samples or [], maxlen=history_size)
+            PROBE_STATS[site_key] = samples
+        samples.append(sample)
+
+def summarize_probe_stats(site_key, site):
+    """Summarize recent probes of a site, or return None if it has not been probed yet"""
+    with PROBE_LOCK:
+        # Samples for a different URL belong to a site that has since been edited or re-numbered
+        samples = [s for s in PROBE_STATS.get(site_key, []) if s['url'] == site['url']]
+    if not samples:
+        return None
+    ok_samples = [s for s in samples if s['ok']]
+    summary = {
+        "samples": len(samples),
+        "ok": len(ok_samples),
+        "last_ok": samples[-1]['ok'],
+        "last_error": samples[-1]['error'],
+        "last_time": samples[-1]['time'],
+        "interactive": None,
+        "locate": None,
+        "ready": None,
+        "reply": None
+    }
+    if ok_samples:
+        summary['interactive'] = statistics.median(s['interactive'] for s in ok_samples)
+        summary['locate'] = statistics.median(s['locate'] for s in ok_samples)
+        summary['ready'] = statistics.median(s['interactive'] + s['locate'] for s in ok_samples)
+        replies = [s['reply'] for s in ok_samples if s['reply'] is not None]
+        summary['reply'] = statistics.median(replies) if replies else None
+    return summary
+
+def print_probe_table(config):
+    """Print the rolling latency table for all probed sites"""
+    rows = []
+    for key, site in config.get('ai_sites', {}).items():
+        summary = summarize_probe_stats(key, site)
+        if summary:
+            rows.append((key, site, summary))
+    if not rows:
+        return
+
+    def fmt(seconds):
+        return f"{seconds:.2f}s" if seconds is not None else "-"
+
+    print("\nSite latency (median of recent probes):")
+    print(f"  {'Site':<24} {'Status':<6} {'Interactive':>11} {'Input':>8} {'Reply':>8} {'OK':>7} {'Age':>7}")
+    for key, site, summary in rows:
+        status = "up" if summary['last_ok'] else "down"
+        age = f"{int(time.time() - summary['last_time'])}s"
+        error = "" if summary['last_ok'] else f"  ({summary['last_error'] or 'error'})"
+        print(f"  {(key + ': ' + site['name'])[:24]:<24} {status:<6} {fmt(summary['interactive']):>11} "
+              f"{fmt(summary['locate']):>8} {fmt(summary['reply']):>8} {summary['ok']:>3}/{summary['samples']:<3} {age:>7}{error}")
+
+def pick_fastest_site(config):
+    """Return the key of the reachable site with the lowest recent latency, or None if none qualify"""
+    max_age = get_probe_settings(config)['max_age_seconds']
+    candidates = {}
+    for key, site in config.get('ai_sites', {}).items():
+        summary = summarize_probe_stats(key, site)
+        if summary and summary['last_ok'] and time.time() - summary['last_time'] <= max_age:
+            candidates[key] = summary
+    if not candidates:
+        return None
+    # Reply latency only counts when every candidate has it, otherwise the comparison would be unfair
+    use_reply = all(summary['reply'] is not None for summary in candidates.values())
+    return min(candidates, key=lambda key: candidates[key]['ready'] + (candidates[key]['reply'] if use_reply else 0))
+
+def probe_all_sites(config, driver=None, stop_event=None):
+    """Probe every configured site once, launching a probe browser unless one is given"""
+    settings = get_probe_settings(config)
+    owns_driver = driver is None
+    temp_dir = None
+    if owns_driver:
+        driver, temp_dir = launch_probe_browser(config, settings)
+    try:
+        # Copy the sites, the menu may change the configuration while a probe round runs
+        for key, site in list(config.get('ai_sites', {}).items()):
+            if stop_event is not None and stop_event.is_set():
+                break
+            record_probe_sample(key, probe_site(driver, site, settings), settings['history_size'])
+    finally:
+        if owns_driver:
+            try:
+                driver.quit()
+            except Exception:
+                pass # Ignore errors during cleanup quit
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+def probe_loop(config, stop_event):
+    """Background thread: probe all sites, then sleep for the configured interval, until stopped"""
+    while not stop_event.is_set():
+        try:
+            probe_all_sites(config, stop_event=stop_event)
+        except Exception as e:
+            # Record the failure against every site so the table shows that probing itself is broken
+            for key, site in list(config.get('ai_sites', {}).items()):
+                record_probe_sample(key, {"time": time.time(), "url": site['url'], "ok": False, "interactive": None,
+                                          "locate": None, "reply": None, "error": f"probe browser: {e}"},
+                                    get_probe_settings(config)['history_size'])
+        stop_event.wait(get_probe_settings(config)['interval_seconds'])
+
+def probing_active():
+    """Check whether background probes are running"""
+    thread = PROBE_STATE['thread']
+    return thread is not None and thread.is_alive()
+
+def toggle_probing(config):
+    """Start background probes of all sites, or stop them if they are already running"""
+    if probing_active():
+        PROBE_STATE['stop_event'].set()
+        print("\nStopping background probes (the current probe round will finish first).")
+        return
+    stop_event = threading.Event()
+    thread = threading.Thread(target=probe_loop, args=(config, stop_event), daemon=True)
+    PROBE_STATE['thread'] = thread
+    PROBE_STATE['stop_event'] = stop_event
+    thread.start()
+    print(f"\nBackground probes started. All sites will be probed every {get_probe_settings(config)['interval_seconds']} seconds.")
+    print("Results appear in the menu's latency table once the first round finishes.")
+# --- End health probes ---
+
 # --- MODIFIED main ---
 def main():
     config = load_config()
@@ -571,10 +1631,37 @@ def main():
         elif choice == 'select_datadir':
             config = select_browser_data_dir(config)
             continue # Go back to selection
+        elif choice == 'config_text':
+            config = configure_text_preprocessing(config)
+            continue # Go back to selection
+        elif choice == 'batch':
+            run_batch(config)
+            continue # Go back to selection
+        elif choice == 'probe':
+            toggle_probing(config)
+            continue # Go back to selection
         elif choice == 'exit': # Handle the new exit option
             print("\nExiting program...")
             return # Exit the main function, which will end the program
 
+        # --- Resolve the "fastest" pseudo-site to a real site using probe results ---
+        auto_route = choice == 'fastest'
+        if auto_route:
+            choice = pick_fastest_site(config)
+            if choice is None:
+                print("\nNo recent probe results. Probing all sites now (this may take a while)...")
+                try:
+                    probe_all_sites(config)
+                except Exception as e:
+                    print(f"Could not run probes: {e}")
+                print_probe_table(config)
+                choice = pick_fastest_site(config)
+            if choice is None:
+                print("No reachable site found.")
+                input("Press Enter to return to AI selection...")
+                continue # Go back to selection
+            print(f"\nFastest available site: {config['ai_sites'][choice]['name']}")
+
         # --- Open selected AI in browser ---
         site = config['ai_sites'][choice]
         browser_profile = config.get('browser_profile', 'Default') # Get global profile
@@ -591,8 +1678,10 @@ def main():
 
         # Initialize WebDriverWait after driver is successfully launched
         wait = WebDriverWait(driver, 30) # Initialize wait here
+        text_settings = get_text_settings(config, site) # Compaction and token limit settings for this site
 
         is_initial = True # Use initial XPath for the first interaction in this browser session
+        conversation = {"last_document": None} # Last clipboard text sent in this browser session, for incremental mode
 
         # --- Main interaction loop for the selected AI ---
         while True: # Starts the loop for interacting with the selected AI
@@ -606,10 +1695,11 @@ def main():
                              "2: Send clipboard screenshot (+ optional prompt)\n"
                              "3: Return to AI selection\n"
                              "4: Exit\n"
-                             "Choice (1/2/3/4): ").strip()
+                             "5: Send clipboard text as a diff against the last text sent (+ optional prompt)\n"
+                             "Choice (1/2/3/4/5): ").strip()
 
-                if mode not in ["1", "2", "3", "4"]:
-                    print("Invalid choice. Please enter 1, 2, 3, or 4.")
+                if mode not in ["1", "2", "3", "4", "5"]:
+                    print("Invalid choice. Please enter 1, 2, 3, 4, or 5.")
                     continue
 
                 # --- Handle user choice ---
@@ -627,7 +1717,27 @@ def main():
                             print(f"Note: Error quitting driver during exit: {e}")
                     return # Exit program completely
 
-                else: # Mode 1 or 2
+                else: # Mode 1, 2 or 5
+                    # --- With the "fastest" pseudo-site, route each new send to the currently fastest site ---
+                    fastest_key = pick_fastest_site(config) if auto_route else None
+                    if fastest_key and fastest_key != choice:
+                        choice = fastest_key
+                        site = config['ai_sites'][choice]
+                        print(f"\nRouting to {site['name']}, currently the fastest available site.")
+                        try:
+                            driver.quit()
+                        except Exception as e:
+                            print(f"Note: Error quitting previous driver session: {e}")
+                        driver = open_in_browser(site['url'], browser_profile, user_data_dir)
+                        if driver is None:
+                            print("\nFailed to launch the browser. Please check error messages above.")
+                            input("Press Enter to return to AI selection...")
+                            break # Break inner loop
+                        wait = WebDriverWait(driver, 30)
+                        text_settings = get_text_settings(config, site)
+                        is_initial = True
+                        conversation = {"last_document": None}
+
                     # --- Check if driver is still valid before sending ---
                     if not driver or not driver.window_handles:
                         print("\nError: Browser window seems to be closed or unresponsive.")
@@ -649,13 +1759,14 @@ def main():
 
                     # --- Send the initial message and check if user wants to continue ---
                     # Pass the wait object to send_to_ai
-                    continue_conversation = send_to_ai(driver, mode, site['initial_xpath'], site['subsequent_xpath'], is_initial, wait)
+                    continue_conversation = send_to_ai(driver, mode, site['initial_xpath'], site['subsequent_xpath'], is_initial, wait, text_settings, conversation)
                     is_initial = False # After the first message, subsequent messages will use the subsequent XPath
 
                     # --- Start Continue Conversation Loop if user chose to continue ---
                     if continue_conversation:
                         print("\nEntering continue conversation mode. Type your message and press Enter to send.")
                         print("Type 'menu' to return to the main AI selection.")
+                        print("Type '/diff' to send the clipboard as a diff against the last text sent.")
 
                         while True: # Loop for continuous text input
                             try: # Inner try block for continue mode messages
@@ -669,6 +1780,13 @@ def main():
                                      print("Empty message. Type 'menu' to exit continue mode.")
                                      continue # Skip sending if the message is empty
 
+                                elif next_message.lower() == '/diff':
+                                    # Re-copied document: send only what changed (falls back to the full text).
+                                    # The slash keeps a plain message that just says "diff" going to the AI.
+                                    if not send_to_ai(driver, "5", site['initial_xpath'], site['subsequent_xpath'], False, wait, text_settings, conversation):
+                                        break # Exit the continue conversation loop
+                                    continue
+
                                 # Locate and send the next message using the subsequent XPath
                                 # Use the subsequent XPath for all messages within the continue mode
                                 xpath_for_continue = site['subsequent_xpath']
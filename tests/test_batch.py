@@ -0,0 +1,242 @@
+"""Check the batch scheduler: load balancing, retries on other browsers, retiring browsers and saving results.
+
+Run with: python -m pytest tests  (or python -m unittest discover tests)
+
+Browsers are replaced by stub drivers, one per data directory, and submit_prompt by a function that
+answers, fails or returns a usage limit notice depending on the data directory.
+"""
+import builtins
+import collections
+import contextlib
+import io
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import invoke
+from selenium.common.exceptions import WebDriverException
+
+SETTINGS = dict(invoke.DEFAULT_CONFIG['batch'], reply_timeout=5)
+LIMIT_NOTICE = "You've reached your usage limit. Please try again later."
+
+def make_worker(key, in_flight=0, latencies=(), status='ready'):
+    """A worker record shaped like the ones run_batch creates"""
+    return {"key": key, "user_data_dir": f"/data/{key}", "status": status, "inbox": queue.Queue(),
+            "in_flight": in_flight, "latencies": collections.deque(latencies, maxlen=5),
+            "consecutive_errors": 0, "completed": 0, "retired_reason": None}
+
+def make_state(prompts):
+    return {"condition": threading.Condition(), "results": {},
+            "pending": collections.deque((index, prompt, 0, None) for index, prompt in enumerate(prompts))}
+
+class StubElement:
+    def __init__(self, text):
+        self.text = text
+
+class StubDriver:
+    """Stands in for one browser; page_shows_limit reads its newest reply and alerts"""
+
+    def __init__(self, user_data_dir):
+        self.key = os.path.basename(user_data_dir)
+        self.replies = []
+        self.alerts = []
+
+    def find_elements(self, by, xpath):
+        if xpath == invoke.LIMIT_NOTICE_XPATH:
+            return [StubElement(text) for text in self.alerts]
+        return [StubElement(text) for text in self.replies]
+
+    def quit(self):
+        pass
+
+class SchedulerTest(unittest.TestCase):
+    def test_pick_worker_balances_in_flight_and_latency(self):
+        fast = make_worker('fast', latencies=[1.0])
+        slow = make_worker('slow', latencies=[4.0])
+        self.assertIs(invoke.pick_worker([fast, slow], 3), fast)
+        # Two prompts queued on the fast worker (3 x 1s) still beat one new prompt on the slow one (4s)
+        fast['in_flight'] = 2
+        self.assertIs(invoke.pick_worker([fast, slow], 3), fast)
+        fast['in_flight'] = 3
+        self.assertIs(invoke.pick_worker([fast, slow], 3), slow) # fast is full
+        slow['in_flight'] = 3
+        self.assertIsNone(invoke.pick_worker([fast, slow], 3))
+
+    def test_pick_worker_tries_new_workers_at_the_pool_average(self):
+        known = make_worker('known', in_flight=1, latencies=[2.0])
+        new = make_worker('new')
+        self.assertIs(invoke.pick_worker([known, new], 2), new)
+        starting = make_worker('starting', status='starting')
+        self.assertIs(invoke.pick_worker([known, starting], 2), known)
+
+    def test_failed_prompt_goes_to_another_worker(self):
+        fast = make_worker('fast', latencies=[1.0])
+        slow = make_worker('slow', latencies=[5.0])
+        state = make_state(["first", "second"])
+        invoke.requeue_prompt(state, state['pending'].popleft(), SETTINGS, "Timed out", 'fast')
+        self.assertEqual(state['pending'][0], (0, "first", 1, 'fast'))
+
+        # The requeued prompt skips the fast worker that just failed it...
+        worker, item = invoke.take_next_prompt(state, [fast, slow], 1)
+        self.assertEqual((worker['key'], item[1]), ('slow', "first"))
+        # ...and while the slow worker is busy with it, the next prompt still goes to the fast one
+        slow['in_flight'] = 1
+        worker, item = invoke.take_next_prompt(state, [fast, slow], 1)
+        self.assertEqual((worker['key'], item[1]), ('fast', "second"))
+
+    def test_failed_prompt_waits_for_the_other_worker(self):
+        fast = make_worker('fast')
+        busy = make_worker('busy', in_flight=1)
+        state = make_state([])
+        state['pending'].append((0, "first", 1, 'fast'))
+        self.assertIsNone(invoke.take_next_prompt(state, [fast, busy], 1))
+        # Once the failing worker is the only one left, it gets the prompt again
+        busy['status'] = 'retired'
+        worker, item = invoke.take_next_prompt(state, [fast, busy], 1)
+        self.assertEqual((worker['key'], item[1]), ('fast', "first"))
+
+    def test_requeue_stops_after_max_attempts(self):
+        state = make_state([])
+        settings = dict(SETTINGS, max_attempts_per_prompt=2)
+        invoke.requeue_prompt(state, (0, "prompt", 0, None), settings, "Timed out", 'a')
+        self.assertEqual(list(state['pending']), [(0, "prompt", 1, 'a')])
+        invoke.requeue_prompt(state, state['pending'].popleft(), settings, "Timed out again", 'b')
+        self.assertFalse(state['pending'])
+        self.assertEqual(state['results'][0],
+                         {"prompt": "prompt", "status": "failed", "error": "Timed out again", "attempts": 2})
+
+    def test_retire_worker_hands_back_queued_prompts(self):
+        worker = make_worker('a', in_flight=2)
+        worker['inbox'].put((3, "three", 0, None))
+        worker['inbox'].put((4, "four", 1, 'b'))
+        state = make_state([])
+        with contextlib.redirect_stdout(io.StringIO()):
+            invoke.retire_worker(worker, state, "usage limit reached")
+        self.assertEqual(worker['status'], 'retired')
+        self.assertEqual(worker['in_flight'], 0)
+        self.assertEqual(sorted(state['pending']), [(3, "three", 0, None), (4, "four", 1, 'b')])
+
+class LimitDetectionTest(unittest.TestCase):
+    def test_only_newest_reply_and_alerts_count(self):
+        phrases = SETTINGS['limit_phrases']
+        driver = StubDriver('/data/a')
+        driver.replies = [LIMIT_NOTICE, "Here is the summary you asked for."]
+        self.assertFalse(invoke.page_shows_limit(driver, '//reply', phrases))
+        driver.alerts = ["Too many requests in 1 hour. Try again later."]
+        self.assertTrue(invoke.page_shows_limit(driver, '//reply', phrases))
+
+    def test_returned_reply_is_checked(self):
+        phrases = SETTINGS['limit_phrases']
+        driver = StubDriver('/data/a')
+        self.assertTrue(invoke.page_shows_limit(driver, '//reply', phrases, LIMIT_NOTICE))
+        # A long answer that discusses rate limits is a real reply, not a notice
+        answer = "To handle a rate limit, back off exponentially. " * 50
+        self.assertFalse(invoke.page_shows_limit(driver, '//reply', phrases, answer))
+
+class RunBatchTest(unittest.TestCase):
+    """Run whole batches with stub browsers; behaviour maps a data directory key to 'ok', 'error' or 'limit'"""
+
+    def run_batch(self, prompts, behaviour, delays=None, batch_settings=None):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        prompts_path = os.path.join(temp_dir.name, "prompts.json")
+        with open(prompts_path, 'w', encoding='utf-8') as f:
+            json.dump(prompts, f)
+        config = {
+            "ai_sites": {"1": {"name": "Stub", "url": "http://stub", "initial_xpath": "//textarea",
+                               "subsequent_xpath": "//textarea", "reply_xpath": "//reply"}},
+            "browser_data_dirs": {key: f"/data/{key}" for key in behaviour},
+            "batch": dict(SETTINGS, **(batch_settings or {}))
+        }
+        calls = collections.Counter()
+
+        def submit_prompt(driver, site, prompt, timeout):
+            calls[driver.key] += 1
+            time.sleep((delays or {}).get(driver.key, 0.01))
+            if behaviour[driver.key] == 'error':
+                raise WebDriverException("chrome not reachable")
+            reply = LIMIT_NOTICE if behaviour[driver.key] == 'limit' else f"{driver.key} answers {prompt}"
+            driver.replies.append(reply)
+            return reply
+
+        answers = ["1", prompts_path, "", ""]
+        with mock.patch.object(invoke, 'open_in_browser', lambda url, profile, data_dir: StubDriver(data_dir)), \
+             mock.patch.object(invoke, 'submit_prompt', submit_prompt), \
+             mock.patch.object(builtins, 'input', side_effect=answers), \
+             contextlib.redirect_stdout(io.StringIO()) as output:
+            invoke.run_batch(config)
+        with open(os.path.join(temp_dir.name, "prompts_results.json"), encoding='utf-8') as f:
+            results = json.load(f)
+        return results, calls, output.getvalue()
+
+    def test_faster_browser_answers_more(self):
+        prompts = [f"prompt {i}" for i in range(30)]
+        results, calls, _ = self.run_batch(prompts, {'fast': 'ok', 'slow': 'ok'}, delays={'fast': 0.01, 'slow': 0.1})
+        self.assertTrue(all(result['status'] == 'ok' for result in results))
+        self.assertEqual([result['prompt'] for result in results], prompts)
+        self.assertGreater(calls['fast'], calls['slow'] * 2)
+
+    def test_limit_notice_retires_browser(self):
+        results, calls, output = self.run_batch([f"prompt {i}" for i in range(20)], {'a': 'ok', 'b': 'limit'})
+        self.assertTrue(all(result['status'] == 'ok' and result['worker'] == 'a' for result in results))
+        self.assertFalse(any(LIMIT_NOTICE in result['response'] for result in results))
+        self.assertEqual(calls['b'], 1)
+        self.assertIn("[b] Taken out of rotation: usage limit reached", output)
+
+    def test_errors_retire_browser_and_prompts_move_on(self):
+        results, calls, output = self.run_batch([f"prompt {i}" for i in range(10)], {'a': 'ok', 'b': 'error'},
+                                                delays={'a': 0.02, 'b': 0.0})
+        self.assertTrue(all(result['status'] == 'ok' and result['worker'] == 'a' for result in results))
+        self.assertEqual(calls['b'], SETTINGS['max_consecutive_errors'])
+        self.assertIn("errors in a row", output)
+
+    def test_prompt_fails_after_max_attempts(self):
+        results, calls, output = self.run_batch(["only"], {'a': 'error', 'b': 'error', 'c': 'error'},
+                                                batch_settings={'max_attempts_per_prompt': 2, 'max_consecutive_errors': 5})
+        self.assertEqual(results[0]['status'], 'failed')
+        self.assertEqual(results[0]['attempts'], 2)
+        # Each attempt went to a different browser
+        self.assertEqual(sorted(calls.values()), [1, 1])
+
+class ResultsFileTest(unittest.TestCase):
+    def test_falls_back_to_working_directory(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            previous_dir = os.getcwd()
+            os.chdir(temp_dir)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()) as output:
+                    path = invoke.save_batch_results([{"status": "ok"}], "/no/such/dir/prompts.txt")
+            finally:
+                os.chdir(previous_dir)
+            self.assertEqual(os.path.realpath(path), os.path.realpath(os.path.join(temp_dir, "prompts_results.json")))
+            self.assertIn("Could not save results to '/no/such/dir/prompts_results.json'", output.getvalue())
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f), [{"status": "ok"}])
+
+class LoadPromptsTest(unittest.TestCase):
+    def load(self, name, content):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            return invoke.load_prompts(path)
+
+    def test_formats(self):
+        self.assertEqual(self.load("p.json", '["one", " two ", "", 3]'), ["one", "two", "3"])
+        self.assertEqual(self.load("p.txt", "one\n\ntwo\n"), ["one", "two"])
+        self.assertEqual(self.load("p.txt", "line 1\nline 2\n---\nnext\n"), ["line 1\nline 2", "next"])
+
+    def test_json_must_be_a_list(self):
+        for content in ['"one prompt"', '{"a": "b"}', '42']:
+            with self.assertRaises(ValueError):
+                self.load("p.json", content)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""Check that the diffs sent in incremental mode apply cleanly with patch.
+
+Run with: python -m pytest tests  (or python -m unittest discover tests)
+"""
+import contextlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import invoke
+
+def apply_patch(old_text, diff):
+    """Apply a unified diff to old_text with the patch tool and return the patched text"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        old_path = os.path.join(temp_dir, "previous.txt")
+        new_path = os.path.join(temp_dir, "current.txt")
+        with open(old_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(old_text)
+        subprocess.run(["patch", "--quiet", "--force", "-o", new_path, old_path],
+                       input=diff.encode('utf-8'), check=True, capture_output=True)
+        with open(new_path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+def random_edit(rng, lines):
+    """Insert, delete or replace a few random lines"""
+    lines = list(lines)
+    for _ in range(rng.randint(1, 4)):
+        position = rng.randint(0, len(lines))
+        action = rng.choice(['insert', 'delete', 'replace'])
+        if action != 'insert' and position < len(lines):
+            del lines[position]
+        if action != 'delete':
+            lines.insert(position, f"edited {rng.random():.6f}")
+    return lines
+
+@unittest.skipUnless(shutil.which("patch"), "patch is not installed")
+class LineDiffPatchTest(unittest.TestCase):
+    def assertRoundTrip(self, old_text, new_text, **kwargs):
+        diff = invoke.line_diff(old_text, new_text, **kwargs)
+        self.assertIsNotNone(diff)
+        if old_text == new_text:
+            self.assertEqual(diff, "")
+        else:
+            self.assertEqual(apply_patch(old_text, diff), new_text, diff)
+
+    def test_trailing_newline_changes(self):
+        self.assertRoundTrip("a\nb\nc\n", "a\nb\nc\n")
+        self.assertRoundTrip("a\nb\nc\n", "a\nB\nc\n")
+        self.assertRoundTrip("a\nb\nc", "a\nB\nc")
+        self.assertRoundTrip("a\nb\nc\n", "a\nb\nc")
+        self.assertRoundTrip("a\nb\nc", "a\nb\nc\n")
+        self.assertRoundTrip("a\nb\nc", "a\nb\nc\nd")
+        self.assertRoundTrip("", "a\nb\n")
+        self.assertRoundTrip("a\nb", "")
+
+    def test_no_phantom_line_for_trailing_newline(self):
+        diff = invoke.line_diff("a\nb\n", "a\nc\n")
+        self.assertEqual(diff, "--- previous\n+++ current\n@@ -1,2 +1,2 @@\n a\n-b\n+c\n")
+        self.assertIn("\\ No newline at end of file\n", invoke.line_diff("a\nb", "a\nc"))
+
+    def test_carriage_returns_are_kept(self):
+        self.assertRoundTrip("one\r\ntwo\r\nthree\r\n", "one\r\n2\r\nthree\r\n")
+        self.assertRoundTrip("progress 10%\rprogress 100%\ndone\n", "progress 10%\rprogress 100%\nfailed\n")
+
+    def test_random_edits(self):
+        rng = random.Random(1234)
+        for _ in range(200):
+            old_lines = [f"line {rng.randrange(40)}" for _ in range(rng.randint(0, 60))]
+            new_lines = random_edit(rng, old_lines)
+            old_end = rng.choice(["", "\n"])
+            new_end = rng.choice(["", "\n"])
+            self.assertRoundTrip('\n'.join(old_lines) + old_end, '\n'.join(new_lines) + new_end)
+
+    def test_random_edits_in_long_spans(self):
+        # A tiny difflib limit sends every span through the unique-line anchors and the chunked fallback
+        rng = random.Random(5678)
+        for _ in range(200):
+            old_lines = [f"line {rng.randrange(rng.choice([5, 80, 1000]))}" for _ in range(rng.randint(0, 120))]
+            new_lines = old_lines
+            for _ in range(rng.randint(1, 5)):
+                new_lines = random_edit(rng, new_lines)
+            if new_lines and rng.random() < 0.3:
+                # Move a block of lines, so some unique lines are out of order
+                start = rng.randrange(len(new_lines))
+                block = new_lines[start:start + rng.randint(1, 10)]
+                del new_lines[start:start + len(block)]
+                position = rng.randint(0, len(new_lines))
+                new_lines[position:position] = block
+            self.assertRoundTrip('\n'.join(old_lines) + '\n', '\n'.join(new_lines) + '\n', max_difflib_lines=8)
+
+class IncrementalTextTest(unittest.TestCase):
+    def test_fence_is_longer_than_backtick_runs_in_the_diff(self):
+        old_text = "# Notes\n" + "Some text.\n" * 50 + "```python\nprint(1)\n```\n"
+        new_text = old_text.replace("print(1)", "print(2)") + "````\nnested\n````\n"
+        with contextlib.redirect_stdout(io.StringIO()):
+            framed = invoke.build_incremental_text(old_text, new_text)
+        self.assertTrue(framed.startswith(invoke.INCREMENTAL_NOTE))
+        opening = framed.split('\n\n', 1)[1].split('\n', 1)[0]
+        self.assertEqual(opening, "`````diff")
+        self.assertTrue(framed.endswith("\n`````"))
+        diff = framed[len(invoke.INCREMENTAL_NOTE) + 2 + len(opening) + 1:-len("`````")]
+        self.assertEqual(diff, invoke.line_diff(old_text, new_text))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            framed = invoke.build_incremental_text("Some text.\n" * 100, "Some text.\n" * 99 + "Other text.\n")
+        self.assertIn("\n\n```diff\n", framed)
+
+class LineDiffSizeTest(unittest.TestCase):
+    def test_edits_far_apart_in_a_large_document(self):
+        old_lines = [f"line {i} of a long log\n" for i in range(200000)]
+        new_lines = list(old_lines)
+        new_lines[5] = "changed near the start\n"
+        new_lines[-5] = "changed near the end\n"
+        old_text, new_text = ''.join(old_lines), ''.join(new_lines)
+        diff = invoke.line_diff(old_text, new_text)
+        self.assertEqual(diff.count("@@ -"), 2)
+        self.assertLess(len(diff), 1000)
+        if shutil.which("patch"):
+            self.assertEqual(apply_patch(old_text, diff), new_text)
+
+    def test_scattered_edits_in_repeated_lines(self):
+        rng = random.Random(42)
+        old_lines = [f"row {rng.randrange(2000)}\n" for _ in range(200000)]
+        new_lines = list(old_lines)
+        for index in range(0, len(new_lines), 1000):
+            new_lines[index] = "edited\n"
+        diff = invoke.line_diff(''.join(old_lines), ''.join(new_lines))
+        self.assertEqual(diff.count("\n+edited\n"), 200)
+        self.assertLess(len(diff), len(''.join(new_lines)) // 10)
+
+    def test_identical_gaps_between_anchors_are_not_diffed(self):
+        # Repeated lines between unique ones leave gaps between anchors; only the gaps with an edit are diffed further
+        rng = random.Random(7)
+        old_lines = [rng.choice(["\n", "}\n", "    return None\n"]) if rng.random() < 0.4 else f"line {i}\n"
+                     for i in range(100000)]
+        new_lines = list(old_lines)
+        for index in rng.sample(range(len(new_lines)), 50):
+            new_lines[index] = f"edited {index}\n"
+        with mock.patch.object(invoke, 'common_line_count', wraps=invoke.common_line_count) as trim:
+            diff = invoke.line_diff(''.join(old_lines), ''.join(new_lines))
+        # Two calls trim each span that is diffed further
+        self.assertLessEqual(trim.call_count, 2 * 51)
+        self.assertEqual(diff.count("\n+edited "), 50)
+        if shutil.which("patch"):
+            self.assertEqual(apply_patch(''.join(old_lines), diff), ''.join(new_lines))
+
+if __name__ == '__main__':
+    unittest.main()
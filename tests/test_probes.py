@@ -0,0 +1,233 @@
+"""Check that health probes record their timings and that 'fastest' routing picks the quicker site.
+
+Run with: python -m pytest tests  (or python -m unittest discover tests)
+
+Two stand-in AI sites are served from http.server: /fast answers quickly, /slow takes longer to load
+and to reply. By default the pages are fetched by a small stand-in driver so no browser is needed.
+If Brave and chromedriver are installed at the paths in invoke.py, the same pages are also probed
+with a real headless browser.
+"""
+import html.parser
+import http.server
+import os
+import re
+import sys
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import invoke
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.keys import Keys
+
+# Seconds each stand-in site waits before serving its page and before answering a prompt
+SITE_DELAYS = {"fast": {"page": 0.05, "reply": 0.1}, "slow": {"page": 0.6, "reply": 0.8}}
+
+# The prompt box sends its text to /<site>/reply on Enter and shows the answer as a new reply element
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><body>
+<div id="replies"></div>
+<textarea id="prompt"></textarea>
+<script>
+document.getElementById('prompt').addEventListener('keydown', function (event) {
+    if (event.key !== 'Enter') return;
+    event.preventDefault();
+    fetch('/%(site)s/reply?q=' + encodeURIComponent(this.value)).then(r => r.text()).then(function (text) {
+        var reply = document.createElement('div');
+        reply.className = 'reply';
+        reply.textContent = text;
+        document.getElementById('replies').appendChild(reply);
+    });
+});
+</script>
+</body></html>
+"""
+
+class StubSiteHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the stand-in chat pages and their replies with per-site delays"""
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        parts = parsed.path.strip('/').split('/')
+        if parts[0] not in SITE_DELAYS:
+            self.send_error(404)
+            return
+        if len(parts) > 1 and parts[1] == 'reply':
+            time.sleep(SITE_DELAYS[parts[0]]['reply'])
+            prompt = urllib.parse.parse_qs(parsed.query).get('q', [''])[0]
+            body = f"{parts[0]} says: {prompt}"
+            content_type = "text/plain; charset=utf-8"
+        else:
+            time.sleep(SITE_DELAYS[parts[0]]['page'])
+            body = PAGE_TEMPLATE % {"site": parts[0]}
+            content_type = "text/html; charset=utf-8"
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # Keep the test output quiet
+
+class IdCollector(html.parser.HTMLParser):
+    """Collect the ids of the elements on a page"""
+
+    def __init__(self):
+        super().__init__()
+        self.ids = set()
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name == 'id':
+                self.ids.add(value)
+
+class StandInElement:
+    """The few WebElement methods the probes use"""
+
+    def __init__(self, driver, text=""):
+        self.driver = driver
+        self.text = text
+        self.typed = ""
+
+    def is_displayed(self):
+        return True
+
+    def click(self):
+        pass
+
+    def send_keys(self, keys):
+        if keys == Keys.RETURN:
+            # Like the page script: fetch the answer in the background and add it as a reply element
+            threading.Thread(target=self.driver.fetch_reply, args=(self.typed,), daemon=True).start()
+        else:
+            self.typed += keys
+
+class StandInDriver:
+    """A driver that fetches pages over HTTP and understands XPaths of the form //*[@id='x'] and //*[@class='x']"""
+
+    def __init__(self):
+        self.url = None
+        self.ids = set()
+        self.replies = []
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                page = response.read().decode('utf-8')
+        except (urllib.error.URLError, OSError) as e:
+            raise WebDriverException(f"unknown error: net::ERR_CONNECTION_REFUSED ({e})")
+        collector = IdCollector()
+        collector.feed(page)
+        self.url = url
+        self.ids = collector.ids
+        with self.lock:
+            self.replies = []
+
+    def execute_script(self, script, *args):
+        return None # No navigation timing, so probes fall back to the measured load time
+
+    def fetch_reply(self, prompt):
+        with urllib.request.urlopen(f"{self.url}/reply?q={urllib.parse.quote(prompt)}", timeout=5) as response:
+            text = response.read().decode('utf-8')
+        with self.lock:
+            self.replies.append(StandInElement(self, text))
+
+    def find_elements(self, by, xpath):
+        match = re.fullmatch(r"//\*\[@(id|class)='([^']*)'\]", xpath)
+        if not match:
+            return []
+        if match.group(1) == 'class':
+            with self.lock:
+                return list(self.replies) if match.group(2) == 'reply' else []
+        return [StandInElement(self)] if match.group(2) in self.ids else []
+
+    def find_element(self, by, xpath):
+        elements = self.find_elements(by, xpath)
+        if not elements:
+            raise WebDriverException(f"no such element: {xpath}")
+        return elements[0]
+
+    def quit(self):
+        pass
+
+class ProbeRoutingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubSiteHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        # A port that was just free, so nothing answers there
+        with http.server.HTTPServer(('127.0.0.1', 0), StubSiteHandler) as closed:
+            down_url = f"http://127.0.0.1:{closed.server_address[1]}/fast"
+
+        site = {"initial_xpath": "//*[@id='prompt']", "subsequent_xpath": "//*[@id='prompt']",
+                "reply_xpath": "//*[@class='reply']"}
+        cls.config = {
+            "ai_sites": {
+                "1": dict(site, name="Slow", url=f"{base_url}/slow"),
+                "2": dict(site, name="Fast", url=f"{base_url}/fast"),
+                "3": dict(site, name="Down", url=down_url)
+            },
+            "probe": {"timeout": 10, "history_size": 5, "canned_prompt": "ping"}
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        invoke.PROBE_STATS.clear()
+
+    def check_probe_round(self, driver):
+        invoke.probe_all_sites(self.config, driver=driver)
+
+        slow = invoke.summarize_probe_stats("1", self.config['ai_sites']['1'])
+        fast = invoke.summarize_probe_stats("2", self.config['ai_sites']['2'])
+        down = invoke.summarize_probe_stats("3", self.config['ai_sites']['3'])
+        for summary in [slow, fast]:
+            self.assertTrue(summary['last_ok'], summary['last_error'])
+            self.assertIsNotNone(summary['interactive'])
+            self.assertIsNotNone(summary['locate'])
+            self.assertIsNotNone(summary['reply'])
+        self.assertGreater(slow['ready'], fast['ready'])
+        self.assertGreater(slow['reply'], fast['reply'])
+        self.assertFalse(down['last_ok'])
+        self.assertIsNotNone(down['last_error'])
+
+        self.assertEqual(invoke.pick_fastest_site(self.config), "2")
+
+    def test_probes_with_stand_in_driver(self):
+        self.check_probe_round(StandInDriver())
+
+    def test_fastest_skips_stale_and_down_sites(self):
+        self.check_probe_round(StandInDriver())
+        # Once the fast site's results are too old, or it goes down, routing falls back to the slow one
+        for sample in invoke.PROBE_STATS["2"]:
+            sample['time'] -= 3600
+        self.assertEqual(invoke.pick_fastest_site(self.config), "1")
+        invoke.record_probe_sample("2", {"time": time.time(), "url": self.config['ai_sites']['2']['url'], "ok": False,
+                                         "interactive": None, "locate": None, "reply": None, "error": "timed out"}, 5)
+        self.assertEqual(invoke.pick_fastest_site(self.config), "1")
+
+    @unittest.skipUnless(os.path.exists(invoke.BRAVE_PATH) and os.path.exists(invoke.CHROMEDRIVER_PATH),
+                         "Brave or chromedriver not installed at the paths in invoke.py")
+    def test_probes_with_headless_brave(self):
+        settings = dict(invoke.get_probe_settings(self.config), headless=True)
+        driver, temp_dir = invoke.launch_probe_browser(self.config, settings)
+        try:
+            self.check_probe_round(driver)
+        finally:
+            driver.quit()
+            if temp_dir:
+                invoke.shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Check clipboard text compaction, token estimates, token limits and their settings.
+
+Run with: python -m pytest tests  (or python -m unittest discover tests)
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import invoke
+
+ALL_PASSES = {"strip_ansi": True, "normalize_whitespace": True, "collapse_repeated_lines": True}
+
+def fifty_megabytes_of_log():
+    """About 50MB of build-log-like text with colour codes, trailing spaces, blank runs and repeated lines"""
+    block = ''.join([
+        "\x1b[32mINFO\x1b[0m 2024-01-01 12:00:00 compiled module {i} in 12ms   \n",
+        "warning: unused variable `x` in src/module_{i}.rs\n",
+        "\n\n\n",
+        "retrying connection...\n" * 3,
+        "  step {i} finished\t\n",
+        "\n",
+    ])
+    return ''.join(block.format(i=i) for i in range(50_000_000 // len(block)))
+
+def quietly(function, *args, answers=()):
+    """Call function with its prints swallowed and input() answered from answers"""
+    with contextlib.redirect_stdout(io.StringIO()), mock.patch('builtins.input', side_effect=list(answers)):
+        return function(*args)
+
+class CompactTextTest(unittest.TestCase):
+    def test_defaults_only_strip_ansi(self):
+        # Collapsing and whitespace normalization change the text, so they are opt-in
+        defaults = invoke.DEFAULT_CONFIG['text_preprocessing']
+        self.assertTrue(defaults['strip_ansi'])
+        self.assertFalse(defaults['collapse_repeated_lines'])
+        self.assertFalse(defaults['normalize_whitespace'])
+        text = "\x1b[31merror\x1b[0m   \nsame\nsame\nsame\n\n\n\nend\n"
+        self.assertEqual(invoke.compact_text(text, defaults), "error   \nsame\nsame\nsame\n\n\n\nend\n")
+
+    def test_strips_csi_and_osc_sequences(self):
+        settings = {"strip_ansi": True}
+        self.assertEqual(invoke.compact_text("\x1b[1;32mok\x1b[0m \x1b[2K\x1b[10Gdone", settings), "ok done")
+        # Window titles and hyperlinks, ended by BEL or by ESC \\
+        self.assertEqual(invoke.compact_text("\x1b]0;title\x07text", settings), "text")
+        self.assertEqual(invoke.compact_text("\x1b]8;;https://example.com\x1b\\link\x1b]8;;\x1b\\", settings), "link")
+        self.assertEqual(invoke.compact_text("\x1b[31mred", {"strip_ansi": False}), "\x1b[31mred")
+
+    def test_collapse_keeps_blank_runs(self):
+        settings = {"collapse_repeated_lines": True}
+        text = "start\nretry\nretry\nretry\n\n\n\nretry\nend\n\n"
+        self.assertEqual(invoke.compact_text(text, settings),
+                         "start\nretry [repeated 3 times]\n\n\n\nretry\nend\n\n")
+
+    def test_normalize_whitespace(self):
+        settings = {"normalize_whitespace": True}
+        text = "\n\nfirst  \r\nsecond\t\n \n\t\n\nthird\nthird\n\n"
+        self.assertEqual(invoke.compact_text(text, settings), "first\nsecond\n\nthird\nthird")
+
+    def test_all_passes(self):
+        text = "\x1b[33mwarn\x1b[0m x  \nwarn x\nwarn x\n\n\n\nok"
+        self.assertEqual(invoke.compact_text(text, ALL_PASSES), "warn x [repeated 3 times]\n\nok")
+
+class TokenTest(unittest.TestCase):
+    def test_estimate_tokens(self):
+        self.assertEqual(invoke.estimate_tokens(""), 0)
+        self.assertEqual(invoke.estimate_tokens("a" * 400), 101)
+        self.assertEqual(invoke.estimate_tokens("a" * 400, chars_per_token=2), 201)
+        # Non-ASCII characters count as roughly one token each
+        self.assertGreaterEqual(invoke.estimate_tokens("\u4f60\u597d" * 100), 200)
+
+    def test_truncate_keeps_text_for_small_budgets(self):
+        truncated = invoke.truncate_to_tokens("a" * 1000, 10)
+        head, marker, tail = truncated.split('\n')
+        self.assertTrue(head and tail)
+        self.assertRegex(marker, r"^\[\.\.\. [\d,]+ characters truncated")
+        self.assertEqual(len(head) + len(tail) + int(marker.split()[1].replace(',', '')), 1000)
+
+    def test_truncate_counts_lines(self):
+        text = ''.join(f"line {i}\n" for i in range(1000))
+        truncated = invoke.truncate_to_tokens(text, 200)
+        self.assertLessEqual(invoke.estimate_tokens(truncated), 200)
+        self.assertTrue(truncated.startswith("line 0\n"))
+        self.assertTrue(truncated.endswith("line 999\n"))
+        self.assertRegex(truncated, r"\[\.\.\. [\d,]+ lines truncated")
+        self.assertEqual(invoke.truncate_to_tokens("short", 200), "short")
+
+    def test_apply_token_limit(self):
+        settings = {"chars_per_token": 4.0, "token_limit": 100, "over_limit_action": "ask"}
+        text = "x\n" * 1000
+        self.assertEqual(quietly(invoke.apply_token_limit, "small", "", settings), "small")
+        self.assertIsNone(quietly(invoke.apply_token_limit, text, "", settings, answers=["c"]))
+        self.assertEqual(quietly(invoke.apply_token_limit, text, "", settings, answers=["?", "s"]), text)
+        truncated = quietly(invoke.apply_token_limit, text, "prompt", settings, answers=["t"])
+        self.assertLessEqual(invoke.estimate_tokens(truncated) + invoke.estimate_tokens("prompt"), 100)
+        self.assertEqual(quietly(invoke.apply_token_limit, text, "", dict(settings, over_limit_action="warn")), text)
+
+class TextSettingsTest(unittest.TestCase):
+    def test_site_overrides(self):
+        config = {"text_preprocessing": {"token_limit": 5000, "collapse_repeated_lines": True}}
+        settings = invoke.get_text_settings(config, {"name": "Site", "token_limit": 800, "chars_per_token": 3.5})
+        self.assertEqual(settings['token_limit'], 800)
+        self.assertEqual(settings['chars_per_token'], 3.5)
+        self.assertTrue(settings['collapse_repeated_lines'])
+        self.assertFalse(settings['normalize_whitespace'])
+
+    def test_rejects_non_positive_numbers(self):
+        config = {"text_preprocessing": {"chars_per_token": 0, "token_limit": -5, "preview_chars": "many"}}
+        site = {"name": "Site", "chars_per_token": -1.0, "token_limit": True}
+        settings = quietly(invoke.get_text_settings, config, site)
+        defaults = invoke.DEFAULT_CONFIG['text_preprocessing']
+        for key in ['chars_per_token', 'token_limit', 'preview_chars']:
+            self.assertEqual(settings[key], defaults[key], key)
+        # A bad site value falls back to a valid global one
+        settings = quietly(invoke.get_text_settings, {"text_preprocessing": {"token_limit": 5000}}, {"token_limit": 0})
+        self.assertEqual(settings['token_limit'], 5000)
+        self.assertGreater(invoke.estimate_tokens("text", settings['chars_per_token']), 0)
+
+    def test_configure_rejects_non_positive_numbers(self):
+        config = {"text_preprocessing": dict(invoke.DEFAULT_CONFIG['text_preprocessing'])}
+        answers = ["", "", "", "0", "-100", "nan", ""]
+        with mock.patch.object(invoke, 'save_config'):
+            quietly(invoke.configure_text_preprocessing, config, answers=answers)
+        self.assertEqual(config['text_preprocessing'], invoke.DEFAULT_CONFIG['text_preprocessing'])
+        answers = ["y", "y", "", "3.5", "2000", "500", "truncate"]
+        with mock.patch.object(invoke, 'save_config'):
+            quietly(invoke.configure_text_preprocessing, config, answers=answers)
+        self.assertEqual(config['text_preprocessing']['chars_per_token'], 3.5)
+        self.assertEqual(config['text_preprocessing']['token_limit'], 2000)
+        self.assertEqual(config['text_preprocessing']['preview_chars'], 500)
+        self.assertTrue(config['text_preprocessing']['collapse_repeated_lines'])
+        self.assertEqual(config['text_preprocessing']['over_limit_action'], 'truncate')
+
+class CompactionSpeedTest(unittest.TestCase):
+    def test_fifty_megabytes_well_under_a_second(self):
+        text = fifty_megabytes_of_log()
+        self.assertGreater(len(text), 45_000_000)
+        for settings in [ALL_PASSES, dict(ALL_PASSES, collapse_repeated_lines=False),
+                         dict(ALL_PASSES, normalize_whitespace=False)]:
+            timings = []
+            for _ in range(3):
+                start_time = time.perf_counter()
+                invoke.compact_text(text, settings)
+                timings.append(time.perf_counter() - start_time)
+            self.assertLess(min(timings), 1.0, settings)
+
+if __name__ == '__main__':
+    unittest.main()